@@ -1,38 +1,173 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required
-from flask_bcrypt import Bcrypt
-import json
+from argon2 import PasswordHasher
+import click
+from argon2.exceptions import InvalidHashError, VerificationError
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from functools import lru_cache
+import bcrypt
+import hashlib
+import multiprocessing
+import orjson
 import os
 import secrets  # For generating a strong secret key
+import sqlite3
+import threading
+import time
+
+# Serialize request and response bodies with orjson instead of the stdlib json module
+class ORJSONProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Initialize Flask app
 app = Flask(__name__, static_folder='.', static_url_path='')
-CORS(app)  # Enable CORS for all routes
+app.json = ORJSONProvider(app)
+# Enable CORS for the JSON API only; browsers may cache preflight responses for a day
+CORS(app, resources={r'/api/*': {'origins': [o.strip() for o in os.environ.get('CORS_ORIGINS', '*').split(',') if o.strip()]}}, max_age=86400)
 
 # --- Configuration ---
 app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', secrets.token_hex(32))  # Generates a random 32-byte hex string
-app.config['USERS_FILE'] = 'users.json'  # Path to store user data
+app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024  # Request bodies here are a few short strings
+app.config['USERS_DB'] = 'users.db'  # SQLite database holding user accounts
+app.config['USERS_FILE'] = 'users.json'  # Legacy JSON store, imported into USERS_DB on first start
+app.config['USERS_LOG_FILE'] = 'users.jsonl'  # Legacy append-only log, imported along with USERS_FILE
+# Argon2id cost parameters. Tune so one verification takes roughly 80ms on the deploy host.
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', '2'))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', '19456'))  # KiB
 
-# Initialize Flask-JWT-Extended and Flask-Bcrypt
+# Initialize Flask-JWT-Extended and the Argon2id hasher
 jwt = JWTManager(app)
-bcrypt = Bcrypt(app)
+PH = PasswordHasher(time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_COST, parallelism=1)
+
+# --- Password Hashing ---
+# Hashing is pure CPU work; run it in worker processes so a slow hash does not
+# stall every other request on the server. Workers are started with 'spawn':
+# they are launched lazily from request threads, and forking there would copy
+# the SQLite connection and whatever locks other threads hold at that moment.
+def _new_hash_pool():
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context('spawn'))
+
+HASH_POOL = _new_hash_pool()
+_HASH_POOL_LOCK = threading.Lock()
+
+# Run fn(*args) in HASH_POOL. If a worker died (e.g. killed by the OOM killer)
+# the pool is broken for good, so replace it and retry once.
+def run_in_hash_pool(fn, *args):
+    global HASH_POOL
+    pool = HASH_POOL
+    try:
+        return pool.submit(fn, *args).result()
+    except BrokenProcessPool:
+        with _HASH_POOL_LOCK:
+            if HASH_POOL is pool:
+                HASH_POOL = _new_hash_pool()
+            pool = HASH_POOL
+        return pool.submit(fn, *args).result()
+
+# New hashes are Argon2id. Accounts created before the switch still hold bcrypt
+# hashes ($2b$...); they verify with bcrypt and are re-hashed on their next login.
+def _is_bcrypt(hashed_password):
+    return hashed_password.startswith(b'$2')
+
+def _hash(password):
+    return PH.hash(password).encode('ascii')
+
+def _verify(hashed_password, password):
+    if _is_bcrypt(hashed_password):
+        return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+    try:
+        return PH.verify(hashed_password, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+# Verify against every hash and return the result for the first. The others
+# are dummies that only equalize timing between login paths (see _login_hashes).
+def _verify_padded(hashes, password):
+    password_ok = _verify(hashes[0], password)
+    for hashed_password in hashes[1:]:
+        _verify(hashed_password, password)
+    return password_ok
+
+def _needs_rehash(hashed_password):
+    return _is_bcrypt(hashed_password) or PH.check_needs_rehash(hashed_password.decode('ascii'))
+
+# Verified against when a login names an unknown user, so the response takes
+# as long as a real password check and does not reveal which usernames exist.
+DUMMY_HASH = _hash(secrets.token_hex(16))
+
+# While legacy bcrypt hashes remain, a login may hit either scheme, so every
+# path does one Argon2 check plus bcrypt work equal to one check at the highest
+# stored cost. That cost is re-read from the database at most every
+# LEGACY_BCRYPT_RECHECK_SECONDS, so hashes migrated by other workers or removed
+# with `flask expire-legacy-hashes` switch the padding off without a restart.
+LEGACY_BCRYPT_RECHECK_SECONDS = 60
+_legacy_bcrypt_cost = None  # Highest stored bcrypt cost, or None once none remain
+_legacy_bcrypt_checked_at = None  # time.monotonic() of the last check, None to force one
+
+@lru_cache(maxsize=None)
+def _bcrypt_dummy(cost):
+    return bcrypt.hashpw(secrets.token_hex(16).encode('ascii'), bcrypt.gensalt(rounds=cost))
+
+def _legacy_bcrypt_hashes_changed():
+    global _legacy_bcrypt_checked_at
+    _legacy_bcrypt_checked_at = None
+
+def _current_legacy_bcrypt_cost():
+    checked_at = _legacy_bcrypt_checked_at
+    if checked_at is None or time.monotonic() - checked_at > LEGACY_BCRYPT_RECHECK_SECONDS:
+        _refresh_legacy_bcrypt_cost(get_db())
+    return _legacy_bcrypt_cost
+
+def _bcrypt_cost(hashed_password):
+    return int(hashed_password.split(b'$')[2])
+
+# Hashes to verify for a login; the first decides the result. user_hash is
+# None for unknown usernames.
+def _login_hashes(user_hash):
+    cost = _current_legacy_bcrypt_cost()
+    if cost is None:
+        return [user_hash or DUMMY_HASH]
+    if user_hash is None:
+        return [DUMMY_HASH, _bcrypt_dummy(cost)]
+    if not _is_bcrypt(user_hash):
+        return [user_hash, _bcrypt_dummy(cost)]
+    # bcrypt time doubles per cost step, so a cost-c check plus dummies at
+    # c, c+1, ..., cost-1 adds up to one check at `cost`.
+    return [user_hash, DUMMY_HASH] + [_bcrypt_dummy(c) for c in range(_bcrypt_cost(user_hash), cost)]
 
 # --- Data for E-Waste specific operations ---
+_REC_TEMPLATES = {
+    'Working': "Consider donating or repairing your {device_type} before recycling.",
+    'Partially Working': "Consider donating or repairing your {device_type} before recycling.",
+    'Smartphone': "This {device_type} likely contains valuable materials. Find a specialized e-waste recycler.",
+    'Laptop': "This {device_type} likely contains valuable materials. Find a specialized e-waste recycler.",
+    'Tablet': "This {device_type} likely contains valuable materials. Find a specialized e-waste recycler.",
+    'Battery': "Batteries should always be recycled separately. Do NOT dispose of them in regular trash.",
+    'TV': "Large electronics like {device_type} often require special pick-up or drop-off.",
+    'Monitor': "Large electronics like {device_type} often require special pick-up or drop-off.",
+}
+
+# Returns (message, recommendation). Cached, so the result is an immutable tuple.
+@lru_cache(maxsize=256)
+def classify(device_type, device_condition):
+    template = _REC_TEMPLATES.get(device_condition, 'Please consult local recycling guidelines.')
+    return (
+        f"You classified a {device_condition} {device_type}.",
+        template.format(device_type=device_type),
+    )
+
 e_waste_data = {
-    'classify': lambda device_type, device_condition: {
-        'message': f"You classified a {device_condition} {device_type}.",
-        'recommendation': {
-            'Working': f"Consider donating or repairing your {device_type} before recycling.",
-            'Partially Working': f"Consider donating or repairing your {device_type} before recycling.",
-            'Smartphone': f"This {device_type} likely contains valuable materials. Find a specialized e-waste recycler.",
-            'Laptop': f"This {device_type} likely contains valuable materials. Find a specialized e-waste recycler.",
-            'Tablet': f"This {device_type} likely contains valuable materials. Find a specialized e-waste recycler.",
-            'Battery': f"Batteries should always be recycled separately. Do NOT dispose of them in regular trash.",
-            'TV': f"Large electronics like {device_type} often require special pick-up or drop-off.",
-            'Monitor': f"Large electronics like {device_type} often require special pick-up or drop-off.",
-        }.get(device_condition, 'Please consult local recycling guidelines.')
-    },
+    'classify': classify,
     'locations': [
         {
             'id': 1,
@@ -103,103 +238,283 @@ e_waste_data = {
     ]
 }
 
-# --- File-based User Storage Functions ---
-def load_users():
-    if not os.path.exists(app.config['USERS_FILE']):
-        return []
-    with open(app.config['USERS_FILE'], 'r', encoding='utf-8') as f:
-        return json.load(f)
+# --- Precomputed API Payloads ---
+# e_waste_data only changes with a deploy, so serialize the GET responses once.
+def _etag(body):
+    return hashlib.md5(body).hexdigest()
+
+_GUIDES_BYTES = orjson.dumps(e_waste_data['education_guides'])
+_GUIDES_ETAG = _etag(_GUIDES_BYTES)
+_LOCATIONS_BYTES = orjson.dumps(e_waste_data['locations'])
+_LOCATIONS_ETAG = _etag(_LOCATIONS_BYTES)
+_EMPTY_LIST_BYTES = orjson.dumps([])
+_EMPTY_LIST_ETAG = _etag(_EMPTY_LIST_BYTES)
+
+# Serialized location list and ETag for each device type, built from an
+# inverted index (device type -> locations that accept it).
+def _build_locations_by_type(locations):
+    by_type = defaultdict(list)
+    for location in locations:
+        for device_type in location['acceptedTypes']:
+            by_type[device_type].append(location)
+    payloads = {}
+    for device_type, matching in by_type.items():
+        payload = orjson.dumps(matching)
+        payloads[device_type] = (payload, _etag(payload))
+    return payloads
+
+_LOC_BY_TYPE = _build_locations_by_type(e_waste_data['locations'])
+
+# Return a precomputed JSON body with an ETag, or 304 if the client already has it.
+def cached_json_response(body, etag, private=False):
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Endpoints behind a JWT must not be stored by shared caches.
+    if private:
+        response.cache_control.private = True
+    else:
+        response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
+
+# --- User Storage ---
+# Users live in SQLite. username is the primary key, so lookups go through its
+# index, and WAL mode lets readers proceed while a registration is written.
+# One connection is shared by all request threads and guarded by USERS_LOCK.
+# Opening it creates the schema and imports the legacy JSON users, however the
+# app was started.
+USERS_LOCK = threading.RLock()
+_db = None
+# PRAGMA user_version: 1 once the table exists and legacy users are imported,
+# 2 once the hash-scheme index exists.
+USERS_DB_VERSION = 2
 
-def save_users(users_list):
-    with open(app.config['USERS_FILE'], 'w', encoding='utf-8') as f:
-        json.dump(users_list, f, indent=2)
+def get_db():
+    global _db
+    with USERS_LOCK:
+        if _db is None:
+            db = sqlite3.connect(app.config['USERS_DB'], check_same_thread=False, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            _migrate_users_db(db)
+            _refresh_legacy_bcrypt_cost(db)
+            _db = db
+        return _db
+
+def _migrate_users_db(db):
+    # IMMEDIATE takes the write lock up front, so concurrent workers import once.
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        version = db.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            db.execute('CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password_hash BLOB NOT NULL)')
+            users = load_users()
+            if not users and db.execute('SELECT 1 FROM users LIMIT 1').fetchone() is None:
+                users = {'testuser': _hash('password123')}
+            # OR IGNORE keeps any account that already exists in the database.
+            db.executemany(
+                'INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)',
+                [(username, h.encode('ascii') if isinstance(h, str) else h) for username, h in users.items()],
+            )
+        if version < 2:
+            # Lets the legacy bcrypt queries below read only the bcrypt rows.
+            db.execute('CREATE INDEX IF NOT EXISTS users_hash_scheme ON users (substr(password_hash, 1, 2))')
+        if version < USERS_DB_VERSION:
+            db.execute(f'PRAGMA user_version = {USERS_DB_VERSION}')
+        db.execute('COMMIT')
+    except BaseException:
+        db.execute('ROLLBACK')
+        raise
+
+def _refresh_legacy_bcrypt_cost(db):
+    global _legacy_bcrypt_cost, _legacy_bcrypt_checked_at
+    # bcrypt hashes look like $2b$12$...; bytes 5-6 are the zero-padded cost.
+    with USERS_LOCK:
+        count, min_cost, max_cost = db.execute(
+            'SELECT COUNT(*), MIN(substr(password_hash, 5, 2)), MAX(substr(password_hash, 5, 2)) '
+            'FROM users WHERE substr(password_hash, 1, 2) = ?',
+            (b'$2',),
+        ).fetchone()
+    if count:
+        # Build every dummy _login_hashes() can ask for before publishing the cost.
+        for cost in range(int(min_cost), int(max_cost) + 1):
+            _bcrypt_dummy(cost)
+    _legacy_bcrypt_cost = int(max_cost) if count else None
+    _legacy_bcrypt_checked_at = time.monotonic()
+
+def count_legacy_bcrypt_hashes():
+    with USERS_LOCK:
+        return get_db().execute('SELECT COUNT(*) FROM users WHERE substr(password_hash, 1, 2) = ?', (b'$2',)).fetchone()[0]
+
+# Accounts that never logged in after the switch to Argon2id keep every login
+# paying for a bcrypt check (see _login_hashes). This deletes them so the
+# padding can stop; their owners can register again under the same name.
+@app.cli.command('expire-legacy-hashes')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def expire_legacy_hashes(yes):
+    """Delete accounts that still have a bcrypt password hash."""
+    count = count_legacy_bcrypt_hashes()
+    if not count:
+        click.echo('No accounts with bcrypt hashes remain.')
+        return
+    if not yes:
+        click.confirm(f'Delete {count} account(s) that have not logged in since the switch to Argon2id?', abort=True)
+    with USERS_LOCK:
+        deleted = get_db().execute('DELETE FROM users WHERE substr(password_hash, 1, 2) = ?', (b'$2',)).rowcount
+    _legacy_bcrypt_hashes_changed()
+    click.echo(f'Deleted {deleted} account(s).')
+
+def get_password_hash(username):
+    with USERS_LOCK:
+        row = get_db().execute('SELECT password_hash FROM users WHERE username = ?', (username,)).fetchone()
+    return row[0] if row else None
+
+def user_exists(username):
+    with USERS_LOCK:
+        return get_db().execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone() is not None
+
+# Raises sqlite3.IntegrityError if the username is taken.
+def add_user(username, password_hash):
+    with USERS_LOCK:
+        get_db().execute('INSERT INTO users (username, password_hash) VALUES (?, ?)', (username, password_hash))
+
+# Replaces old_hash; returns False if the stored hash was already changed by someone else.
+def update_password_hash(username, old_hash, password_hash):
+    with USERS_LOCK:
+        cursor = get_db().execute('UPDATE users SET password_hash = ? WHERE username = ? AND password_hash = ?',
+                                  (password_hash, username, old_hash))
+    return cursor.rowcount == 1
+
+# Read users from the JSON snapshot and append-only log used before SQLite.
+def load_users():
+    users = {}
+    if os.path.exists(app.config['USERS_FILE']):
+        with open(app.config['USERS_FILE'], 'rb') as f:
+            for user in orjson.loads(f.read()):
+                users[user['username']] = user['password']
+    if os.path.exists(app.config['USERS_LOG_FILE']):
+        with open(app.config['USERS_LOG_FILE'], 'rb') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    user = orjson.loads(line)
+                    users[user['username']] = user['password']
+    return users
 
 # --- Initialize users ---
+# Opens the database (and runs any pending import) before the first request
+# instead of during it.
 def initialize_users_on_startup():
-    users = load_users()
-    if not users:
-        hashed_password = bcrypt.generate_password_hash('password123').decode('utf-8')
-        users.append({'username': 'testuser', 'password': hashed_password})
-        save_users(users)
-    return users
+    get_db()
+
+# --- Request Validation ---
+MAX_USERNAME_LENGTH = 64
+MAX_PASSWORD_BYTES = 72  # Legacy bcrypt hashes only cover the first 72 bytes of a password
+MAX_DEVICE_FIELD_LENGTH = 64  # Bounds classify()'s cache keys and results
+INVALID_CREDENTIALS_MESSAGE = (f'Username (up to {MAX_USERNAME_LENGTH} characters) and password '
+                               f'(up to {MAX_PASSWORD_BYTES} bytes) are required.')
+
+# Returns the JSON body as a dict, or an empty dict if it is missing or malformed.
+def get_json_body():
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
+
+# Returns (username, password) from the JSON body, or None if either is missing or too long.
+def get_credentials():
+    data = get_json_body()
+    username = data.get('username')
+    password = data.get('password')
+    if not isinstance(username, str) or not username or len(username) > MAX_USERNAME_LENGTH:
+        return None
+    if not isinstance(password, str) or not password or len(password.encode('utf-8')) > MAX_PASSWORD_BYTES:
+        return None
+    return username, password
 
 # --- Frontend Serving Routes ---
 @app.route('/')
 def serve_index():
-    return send_from_directory('.', 'index.html')
+    return send_from_directory('.', 'index.html', max_age=3600)
 
 @app.route('/style.css')
 def serve_css():
-    return send_from_directory('.', 'style.css')
+    return send_from_directory('.', 'style.css', max_age=3600)
 
 # --- API Endpoints ---
 @app.route('/api/register', methods=['POST'])
 def register():
-    data = request.get_json()
-    username = data.get('username')
-    password = data.get('password')
+    credentials = get_credentials()
+    if credentials is None:
+        return jsonify({'message': INVALID_CREDENTIALS_MESSAGE}), 400
+    username, password = credentials
 
-    if not username or not password:
-        return jsonify({'message': 'Username and password are required.'}), 400
-
-    users = load_users()
-    if any(u['username'] == username for u in users):
+    # Reject taken names before spending a password hash on them. The INSERT
+    # still guards against a concurrent registration of the same name.
+    if user_exists(username):
         return jsonify({'message': 'Username already exists. Please choose a different one.'}), 409
 
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
-    users.append({'username': username, 'password': hashed_password})
-    save_users(users)
+    hashed_password = run_in_hash_pool(_hash, password)
+    try:
+        add_user(username, hashed_password)
+    except sqlite3.IntegrityError:
+        return jsonify({'message': 'Username already exists. Please choose a different one.'}), 409
 
     return jsonify({'message': 'Registration successful! You can now log in.'}), 201
 
 @app.route('/api/login', methods=['POST'])
 def login():
-    data = request.get_json()
-    username = data.get('username')
-    password = data.get('password')
+    credentials = get_credentials()
+    if credentials is None:
+        return jsonify({'message': INVALID_CREDENTIALS_MESSAGE}), 400
+    username, password = credentials
 
-    users = load_users()
-    user = next((u for u in users if u['username'] == username), None)
+    user_hash = get_password_hash(username)
+    password_ok = run_in_hash_pool(_verify_padded, _login_hashes(user_hash), password)
 
-    if not user or not bcrypt.check_password_hash(user['password'], password):
+    if user_hash is None or not password_ok:
         return jsonify({'message': 'Invalid username or password.'}), 401
 
+    # Upgrade bcrypt or outdated Argon2 hashes now that we have the plaintext.
+    if _needs_rehash(user_hash):
+        upgraded = update_password_hash(username, user_hash, run_in_hash_pool(_hash, password))
+        if upgraded and _is_bcrypt(user_hash):
+            _legacy_bcrypt_hashes_changed()
+
     access_token = create_access_token(identity=username)
     return jsonify({'message': 'Login successful!', 'token': access_token, 'username': username}), 200
 
 @app.route('/api/classify', methods=['POST'])
 @jwt_required()
 def classify_route():
-    data = request.get_json()
+    data = get_json_body()
     device_type = data.get('deviceType')
     device_condition = data.get('deviceCondition')
 
-    if not device_type or not device_condition:
-        return jsonify({'message': 'Device type and condition are required.'}), 400
-
-    result_data = e_waste_data['classify'](device_type, device_condition)
-    result_data['deviceType'] = device_type
-    result_data['deviceCondition'] = device_condition
+    for field in (device_type, device_condition):
+        if not isinstance(field, str) or not field or len(field) > MAX_DEVICE_FIELD_LENGTH:
+            return jsonify({'message': f'Device type and condition (up to {MAX_DEVICE_FIELD_LENGTH} characters each) are required.'}), 400
 
-    return jsonify(result_data)
+    message, recommendation = e_waste_data['classify'](device_type, device_condition)
+    return jsonify({
+        'message': message,
+        'recommendation': recommendation,
+        'deviceType': device_type,
+        'deviceCondition': device_condition,
+    })
 
 @app.route('/api/recycling_locations', methods=['GET'])
 @jwt_required()
 def get_recycling_locations():
     device_type_filter = request.args.get('device_type')
 
-    filtered_locations = e_waste_data['locations']
+    body, etag = _LOCATIONS_BYTES, _LOCATIONS_ETAG
     if device_type_filter and device_type_filter != 'All':
-        filtered_locations = [
-            loc for loc in e_waste_data['locations']
-            if device_type_filter in loc['acceptedTypes']
-        ]
-    return jsonify(filtered_locations)
+        body, etag = _LOC_BY_TYPE.get(device_type_filter, (_EMPTY_LIST_BYTES, _EMPTY_LIST_ETAG))
+    return cached_json_response(body, etag, private=True)
 
 @app.route('/api/education/guides', methods=['GET'])
 def get_education_guides():
-    return jsonify(e_waste_data['education_guides'])
+    return cached_json_response(_GUIDES_BYTES, _GUIDES_ETAG)
 
 if __name__ == '__main__':
     initialize_users_on_startup()
-    app.run(debug=True, port=5000)
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', port=5000)
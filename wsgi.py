@@ -0,0 +1,6 @@
+# WSGI entry point for production servers, e.g.:
+#   gunicorn -b 127.0.0.1:5000 -w 1 -k gthread --threads 8 --keep-alive 5 wsgi:application
+from app import app, initialize_users_on_startup
+
+initialize_users_on_startup()
+application = app